@@ -9,12 +9,27 @@ from reportlab.lib.units import cm
 from reportlab.lib.colors import HexColor
 from reportlab.platypus import Paragraph
 from reportlab.lib.styles import ParagraphStyle
+from reportlab.pdfbase.pdfmetrics import stringWidth
 from PIL import Image
-from io import BytesIO
+from io import BytesIO, StringIO
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import csv
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import urllib.parse
 import os
+import tempfile
+
+# PyArrow (opcional): parser CSV en C para catálogos grandes
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.compute as pc
+    HAS_ARROW = True
+except ImportError:
+    HAS_ARROW = False
 
 # ---------- PALETA CATA ----------
 GREEN = HexColor("#22C55E")
@@ -23,6 +38,40 @@ CREAM = HexColor("#FFFFFF")
 GRAY = HexColor("#F3F4F6")
 TEXT = HexColor("#111827")
 
+# ---------- MEDIDAS ----------
+# Precalculadas en puntos al importar el módulo
+PAGE_WIDTH, PAGE_HEIGHT = A4
+SIDE_CM = 3 * cm
+TOP_CM = 3 * cm
+BOTTOM_CM = 3 * cm
+IMG_CM = 3.2 * cm
+CARD_CM = 4.6 * cm
+CARD_STEP = CARD_CM + 0.4 * cm
+CONTENT_WIDTH = PAGE_WIDTH - (SIDE_CM * 2)
+
+# Cabecera de categoría
+CATEGORY_H = 1.4 * cm
+CATEGORY_DY = 1.2 * cm
+CATEGORY_TEXT_DY = 0.9 * cm
+CATEGORY_STEP = 2.4 * cm
+
+# Tarjeta de producto (desplazamientos desde el borde superior de la tarjeta)
+CARD_PANEL_H = CARD_CM - 0.6 * cm
+CARD_IMG_X = SIDE_CM + 1 * cm
+CARD_IMG_DY = IMG_CM + 0.8 * cm
+CARD_TEXT_X = SIDE_CM + IMG_CM + 2.2 * cm
+CARD_NAME_DY = 1.6 * cm
+CARD_PRICE_DY = 2.7 * cm
+CARD_BUTTON_DY = 4.1 * cm
+BUTTON_W = 5 * cm
+BUTTON_H = 1.3 * cm
+
+FOOTER_W = 6 * cm
+FOOTER_H = 1.3 * cm
+FOOTER_Y = 2 * cm
+LOGO_SIZE = 12 * cm
+WM_SPACING = 7 * cm
+
 # ---------- ESTILOS ----------
 title_style = ParagraphStyle(
     name="Title",
@@ -42,25 +91,38 @@ intro_style = ParagraphStyle(
     leading=16
 )
 
-# ---------- CACHE ----------
+# ---------- HTTP ----------
+IMAGE_WORKERS = 16
+
+# Pool mayor que el número de hilos de descarga para reutilizar conexiones keep-alive
 session = requests.Session()
-image_cache = {}
-whatsapp_cache = {}
+_adapter = HTTPAdapter(
+    pool_connections=IMAGE_WORKERS * 2,
+    pool_maxsize=IMAGE_WORKERS * 2,
+    max_retries=Retry(total=2, backoff_factor=0.2),
+)
+session.mount("https://", _adapter)
+session.mount("http://", _adapter)
+
+# Todo byte que no sea 0-9; bytes.translate los elimina en C
+_NON_DIGITS = bytes(b for b in range(256) if not 0x30 <= b <= 0x39)
 
+@lru_cache(maxsize=64)
 def normalize_whatsapp(whatsapp):
-    return "".join(filter(str.isdigit, str(whatsapp)))
+    return str(whatsapp).encode("ascii", "ignore").translate(None, _NON_DIGITS).decode("ascii")
 
 # ==========================================
 # CSV → DATA
 # ==========================================
 
-def _find_field(row, candidates):
-    keys = {k.lower().strip(): k for k in row.keys()}
+def _find_column(header, candidates):
+    """Índice de la primera columna cuyo nombre contiene algún candidato, o -1."""
+    keys = [k.lower().strip() for k in header]
     for cand in candidates:
-        for k_lower, k in keys.items():
-            if cand in k_lower:
-                return row.get(k, "").strip()
-    return ""
+        for i, k in enumerate(keys):
+            if cand in k:
+                return i
+    return -1
 
 
 def _parse_price(raw):
@@ -77,21 +139,111 @@ def _parse_price(raw):
         return None
 
 
-def load_products_from_csv(csv_path):
-    """Carga productos desde CSV intentando mapear nombres de columnas comunes en distintos idiomas."""
-    data = []
-    with open(csv_path, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            category = _find_field(row, ["category", "categoria", "cat"]) or ""
-            name = _find_field(row, ["name", "titulo", "title", "nombre"]) or ""
-            price_raw = _find_field(row, ["price", "precio", "valor"]) or ""
-            image_url = _find_field(row, ["image", "imagen", "image_url", "img", "imagen_url"]) or ""
+def _parse_prices(raws):
+    """Convierte la columna de precios completa: cada valor distinto se parsea una sola vez."""
+    parsed = {}
+    for raw in dict.fromkeys(raws):
+        # Atajo para el caso común ("15000", "12.5"): float directo sin limpiar
+        if raw.replace(".", "", 1).isdigit():
+            try:
+                parsed[raw] = float(raw)
+                continue
+            except ValueError:
+                pass
+        parsed[raw] = _parse_price(raw)
+    return list(map(parsed.__getitem__, raws))
+
+
+# Candidatos por columna: categoría, nombre, precio, imagen
+PRODUCT_COLUMNS = (
+    ["category", "categoria", "cat"],
+    ["name", "titulo", "title", "nombre"],
+    ["price", "precio", "valor"],
+    ["image", "imagen", "image_url", "img", "imagen_url"],
+)
+
+
+def _read_products(reader, indices):
+    ci_cat, ci_name, ci_price, ci_img = indices
+    rows = []
+    _strip = str.strip
+    for row in reader:
+        n = len(row)
+        category = _strip(row[ci_cat]) if -1 < ci_cat < n else ""
+        name = _strip(row[ci_name]) if -1 < ci_name < n else ""
+        if not (category and name):
+            continue
+        price_raw = _strip(row[ci_price]) if -1 < ci_price < n else ""
+        image_url = _strip(row[ci_img]) if -1 < ci_img < n else ""
+
+        rows.append((category, name, price_raw, image_url))
+
+    # Precios en una sola pasada por columna
+    prices = _parse_prices([row[2] for row in rows])
+    return [
+        (category, name, price, image_url)
+        for (category, name, _, image_url), price in zip(rows, prices)
+    ]
+
+
+def _read_products_arrow(csv_source, n_columns, indices):
+    """Igual que `_read_products` pero parseando en C; None si el CSV no es una tabla regular."""
+    ci_cat, ci_name, ci_price, ci_img = indices
+    if ci_cat < 0 or ci_name < 0:
+        return []
+
+    names = [f"c{i}" for i in range(n_columns)]
+    used = list(dict.fromkeys(names[i] for i in indices if i > -1))
+    try:
+        if isinstance(csv_source, (bytes, bytearray)):
+            csv_source = pa.BufferReader(csv_source)
+        table = pacsv.read_csv(
+            csv_source,
+            read_options=pacsv.ReadOptions(column_names=names, skip_rows=1),
+            parse_options=pacsv.ParseOptions(newlines_in_values=True),
+            convert_options=pacsv.ConvertOptions(
+                include_columns=used,
+                column_types={name: pa.string() for name in used},
+                strings_can_be_null=False,
+            ),
+        )
+    except pa.ArrowInvalid:
+        return None
+
+    columns = {name: pc.utf8_trim_whitespace(table[name]) for name in used}
+    category, name = columns[names[ci_cat]], columns[names[ci_name]]
+    keep = pc.and_(pc.not_equal(category, ""), pc.not_equal(name, ""))
+    categories = category.filter(keep).to_pylist()
+
+    def values(i):
+        if i < 0:
+            return [""] * len(categories)
+        return columns[names[i]].filter(keep).to_pylist()
+
+    return list(zip(categories, values(ci_name), _parse_prices(values(ci_price)), values(ci_img)))
+
 
-            price = _parse_price(price_raw)
+def _open_csv(csv_source):
+    """Abre el CSV como texto: `csv_source` es una ruta o el contenido en bytes."""
+    if isinstance(csv_source, (bytes, bytearray)):
+        return StringIO(csv_source.decode("utf-8"), newline="")
+    return open(csv_source, newline="", encoding="utf-8")
 
-            if category and name:
-                data.append((category, name, price, image_url))
+
+def load_products_from_csv(csv_source):
+    """Carga productos desde CSV (ruta o bytes) intentando mapear nombres de columnas comunes en distintos idiomas."""
+    with _open_csv(csv_source) as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if not header:
+            return []
+
+        # Resolver columnas una sola vez; cada fila se lee por posición
+        indices = [_find_column(header, candidates) for candidates in PRODUCT_COLUMNS]
+
+        data = _read_products_arrow(csv_source, len(header), indices) if HAS_ARROW else None
+        if data is None:
+            data = _read_products(reader, indices)
     data.sort(key=lambda x: x[0])
     return data
 
@@ -99,46 +251,47 @@ def load_products_from_csv(csv_path):
 # UTILIDADES
 # ==========================================
 
+@lru_cache(maxsize=4096)
 def truncate(text, max_len=55):
+    # len() de un str es O(1) y cuesta la mitad que probar con text[max_len:]
     return text if len(text) <= max_len else text[:max_len - 3] + "..."
 
+# 3.2 cm (tamaño de la imagen en la tarjeta) a 150 dpi
+IMAGE_MAX_PX = 189
+
 def get_image(url):
+    """Descarga una imagen y la devuelve como miniatura JPEG (bytes), o None si falla."""
     if not url:
         return None
-    if url in image_cache:
-        return image_cache[url]
     try:
         r = session.get(url, timeout=6)
         r.raise_for_status()
         img = Image.open(BytesIO(r.content)).convert("RGB")
-        img.thumbnail((400, 400), Image.LANCZOS)
-        reader = ImageReader(img)
-        image_cache[url] = reader
-        return reader
+        img.thumbnail((IMAGE_MAX_PX, IMAGE_MAX_PX), Image.LANCZOS)
+        # ReportLab incrusta el JPEG tal cual (DCTDecode) en vez de píxeles sin comprimir
+        buf = BytesIO()
+        img.save(buf, "JPEG", quality=75, optimize=True)
+        return buf.getvalue()
     except:
-        image_cache[url] = None
         return None
 
+def fetch_images(data):
+    """Descarga en paralelo cada imagen distinta del catálogo: {url: bytes JPEG | None}."""
+    urls = list({row[3] for row in data if row[3]})
+    if not urls:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(IMAGE_WORKERS, len(urls))) as pool:
+        return dict(zip(urls, pool.map(get_image, urls)))
+
+# Partes fijas del mensaje, codificadas una sola vez (quote es carácter a carácter)
+_WA_PREFIX = urllib.parse.quote("Hola, quiero este producto desde el catálogo:\n\n• ")
+_WA_PRICE = urllib.parse.quote("\nPrecio: $")
+_WA_SUFFIX = urllib.parse.quote("\n\n¿Está disponible?")
+
 def whatsapp_link(product, price, whatsapp):
     whatsapp = normalize_whatsapp(whatsapp)
-    key = (product, price, whatsapp)
-    if key in whatsapp_cache:
-        return whatsapp_cache[key]
-
-    lines = [
-        "Hola, quiero este producto desde el catálogo:",
-        "",
-        f"• {product}"
-    ]
-    if price:
-        lines.append(f"Precio: ${price:,.0f}")
-    lines.append("")
-    lines.append("¿Está disponible?")
-
-    msg = "\n".join(lines)
-    link = f"https://wa.me/{whatsapp}?text={urllib.parse.quote(msg)}"
-    whatsapp_cache[key] = link
-    return link
+    price_part = f"{_WA_PRICE}{urllib.parse.quote(f'{price:,.0f}')}" if price else ""
+    return f"https://wa.me/{whatsapp}?text={_WA_PREFIX}{urllib.parse.quote(product)}{price_part}{_WA_SUFFIX}"
 
 # ==========================================
 # ELEMENTOS VISUALES
@@ -159,78 +312,230 @@ def draw_button(c, x, y, w, h, text, url):
     c.linkURL(url, (x, y, x + w, y + h), relative=0)
 
 def draw_footer(c, width, whatsapp):
-    w, h = 6 * cm, 1.3 * cm
-    x = (width - w) / 2
+    x = (width - FOOTER_W) / 2
     link = whatsapp_link("Pedido desde el catálogo", None, whatsapp)
-    draw_button(c, x, 2 * cm, w, h, "Finalizar pedido", link)
+    draw_button(c, x, FOOTER_Y, FOOTER_W, FOOTER_H, "Finalizar pedido", link)
+
+def draw_cards(c, cards):
+    """Dibuja las tarjetas de una página agrupadas por estado gráfico: un cambio de color/fuente por pasada."""
+    if not cards:
+        return
+    c.setStrokeColor(GREEN_BORDER)
+    c.setLineWidth(1)
+
+    c.setFillColor(GRAY)
+    for y, _, _, _, _ in cards:
+        c.roundRect(SIDE_CM, y - CARD_CM, CONTENT_WIDTH, CARD_PANEL_H, 20, fill=1)
+
+    for y, img, _, _, _ in cards:
+        if img:
+            c.saveState()
+            c.translate(CARD_IMG_X, y - CARD_IMG_DY)
+            c.doForm(img)
+            c.restoreState()
+
+    c.setFillColor(TEXT)
+    c.setFont("Helvetica", 10)
+    for y, _, name, _, _ in cards:
+        c.drawString(CARD_TEXT_X, y - CARD_NAME_DY, name)
+
+    c.setFont("Helvetica-Bold", 12)
+    for y, _, _, price_text, _ in cards:
+        c.drawString(CARD_TEXT_X, y - CARD_PRICE_DY, price_text)
+
+    # Botones "Lo quiero" (mismo dibujo que draw_button)
+    c.setFillColor(GREEN)
+    for y, _, _, _, _ in cards:
+        c.roundRect(CARD_TEXT_X, y - CARD_BUTTON_DY, BUTTON_W, BUTTON_H, 14, fill=1, stroke=1)
+    c.setFillColor(CREAM)
+    c.setFont("Helvetica-Bold", 10)
+    for y, _, _, _, link in cards:
+        by = y - CARD_BUTTON_DY
+        c.drawCentredString(CARD_TEXT_X + BUTTON_W / 2, by + BUTTON_H / 2 - 4, "Lo quiero")
+        c.linkURL(link, (CARD_TEXT_X, by, CARD_TEXT_X + BUTTON_W, by + BUTTON_H), relative=0)
+
+def define_image_forms(c, images):
+    """Registra cada imagen distinta una vez como Form XObject: {url: nombre del formulario}.
+    drawImage con un ImageReader recalcula el md5 de los píxeles en cada llamada; doForm no."""
+    forms = {}
+    for i, (url, jpeg) in enumerate(images.items()):
+        if not jpeg:
+            continue
+        name = f"cata_img{i}"
+        c.beginForm(name)
+        c.drawImage(ImageReader(BytesIO(jpeg)), 0, 0, IMG_CM, IMG_CM, mask="auto")
+        c.endForm()
+        forms[url] = name
+    return forms
 
 # ---------- MARCAS DE AGUA ----------
 
-def draw_logo_watermark(c, width, height, logo_path):
-    if not os.path.exists(logo_path):
+# 12 cm a 150 dpi: más resolución no se aprecia en la marca de agua
+LOGO_MAX_PX = 709
+LOGO_ALPHA = 0.05
+
+def prepare_logo(logo_source, cache_path=None):
+    """Decodifica y reduce el logo (ruta o bytes) y hornea su transparencia sobre el fondo: PNG opaco, o None.
+    Con `cache_path` (una ruta por contenido del logo) el resultado se reutiliza entre trabajos."""
+    if cache_path:
+        # Sin comprobar antes: el limpiador puede borrarlo entre la comprobación y la lectura
+        try:
+            with open(cache_path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+    if isinstance(logo_source, (bytes, bytearray)):
+        logo_source = BytesIO(logo_source)
+    elif not logo_source or not os.path.exists(logo_source):
+        return None
+    try:
+        img = Image.open(logo_source)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA")
+        img.thumbnail((LOGO_MAX_PX, LOGO_MAX_PX), Image.LANCZOS)
+
+        # Mezcla al 5% sobre el fondo de la página: sin alpha en el PDF, el logo puede ir dentro del formulario
+        if img.mode == "RGBA":
+            mask = img.getchannel("A").point(lambda a: round(a * LOGO_ALPHA))
+        else:
+            mask = Image.new("L", img.size, round(255 * LOGO_ALPHA))
+        background = tuple(round(v * 255) for v in CREAM.rgb())
+        baked = Image.new("RGB", img.size, background)
+        baked.paste(img.convert("RGB"), mask=mask)
+
+        buf = BytesIO()
+        baked.save(buf, format="PNG", compress_level=1)
+    except:
+        return None
+
+    png = buf.getvalue()
+    if cache_path:
+        # Temporal único por llamada (trabajos simultáneos con el mismo logo); si la caché
+        # no se puede escribir, el logo sigue sirviendo para este trabajo
+        try:
+            with tempfile.NamedTemporaryFile(
+                dir=os.path.dirname(cache_path), prefix=os.path.basename(cache_path) + ".",
+                suffix=".tmp", delete=False
+            ) as f:
+                f.write(png)
+            os.replace(f.name, cache_path)
+        except OSError:
+            pass
+    return png
+
+def load_logo(logo):
+    """ImageReader del logo ya preparado por `prepare_logo`; uno por documento."""
+    if not logo:
+        return None
+    try:
+        return ImageReader(BytesIO(logo))
+    except:
+        return None
+
+def draw_logo_watermark(c, width, height, logo):
+    if logo is None:
         return
     try:
-        c.saveState()
-        c.setFillAlpha(0.05)
-        size = 12 * cm
-        x = (width - size) / 2
-        y = (height - size) / 2
-        c.drawImage(logo_path, x, y, size, size, mask="auto")
-        c.restoreState()
+        x = (width - LOGO_SIZE) / 2
+        y = (height - LOGO_SIZE) / 2
+        c.drawImage(logo, x, y, LOGO_SIZE, LOGO_SIZE)
     except:
         pass
 
 def draw_text_watermark(c, width, height):
     c.saveState()
-    c.setFillAlpha(0.035)
-    c.setFont("Helvetica-Bold", 26)
     c.setFillColor(TEXT)
     c.translate(width / 2, height / 2)
     c.rotate(30)
 
     text = "Creado con CATA · Catálogos para WhatsApp"
-    spacing = 7 * cm
-
-    for x in range(-int(width), int(width), int(spacing)):
-        for y in range(-int(height), int(height), int(spacing)):
-            c.drawCentredString(x, y, text)
+    step = int(WM_SPACING)
+    half = stringWidth(text, "Helvetica-Bold", 26) / 2
+
+    xs = range(-int(width), int(width), step)
+    ys = range(-int(height), int(height), step)
+
+    # Un solo bloque BT/ET para todo el mosaico, con desplazamientos relativos (Td) entre copias
+    tile = c.beginText(xs[0] - half, ys[0])
+    tile.setFont("Helvetica-Bold", 26)
+    prev_x, prev_y = xs[0], ys[0]
+    for x in xs:
+        for y in ys:
+            if (x, y) != (prev_x, prev_y):
+                tile.moveCursor(x - prev_x, prev_y - y)  # moveCursor mide y hacia abajo
+                prev_x, prev_y = x, y
+            tile.textOut(text)
+    c.drawText(tile)
 
     c.restoreState()
 
+WATERMARK_FORM = "cata_watermark"
+
+def define_watermark_form(c, width, height, logo):
+    """Registra logo y mosaico de texto una sola vez como Form XObject; cada página solo lo referencia."""
+    c.beginForm(WATERMARK_FORM)
+    draw_logo_watermark(c, width, height, logo)
+    draw_text_watermark(c, width, height)
+    c.endForm()
+
+def draw_page_base(c, width, height, watermark):
+    draw_background(c, width, height)
+    if watermark:
+        c.doForm(WATERMARK_FORM)
+
 # ==========================================
 # FUNCIÓN PRINCIPAL
 # ==========================================
 
+def warm_up():
+    """Inicializador de los procesos de render: con el módulo ya importado, carga las fuentes
+    y ejercita el canvas una vez para que el primer catálogo no pague ese coste."""
+    for font in ("Helvetica", "Helvetica-Bold"):
+        stringWidth("CATA", font, 10)
+    c = canvas.Canvas(BytesIO(), pagesize=A4, pageCompression=1)
+    draw_page_base(c, PAGE_WIDTH, PAGE_HEIGHT, False)
+    c.showPage()
+    c.save()
+
+def prepare_catalog(csv_source, logo_source, logo_cache=None):
+    """Lee el CSV, descarga las imágenes y prepara el logo una sola vez para todas las versiones del PDF."""
+    products = load_products_from_csv(csv_source)
+    return products, fetch_images(products), prepare_logo(logo_source, logo_cache)
+
 def generate_cata(
-    csv_path,
-    logo_path,
+    data,
+    images,
+    logo,
     whatsapp,
     output_path,
     watermark=True
 ):
+    """Dibuja el catálogo con productos, imágenes y logo ya preparados (ver `prepare_catalog`)."""
     print("🚀 Generando CATA...")
 
     whatsapp = normalize_whatsapp(whatsapp)
-    data = load_products_from_csv(csv_path)
 
-    c = canvas.Canvas(output_path, pagesize=A4)
+    # Se escribe aparte y se renombra: otro proceso nunca sirve un PDF a medio escribir.
+    # Temporal único: dos renders del mismo job pueden coincidir en el mismo proceso
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(output_path) or ".", prefix=os.path.basename(output_path) + ".", suffix=".tmp"
+    )
+    os.close(fd)
+    c = canvas.Canvas(tmp_path, pagesize=A4, pageCompression=1)
+    image_forms = define_image_forms(c, images)
     width, height = A4
 
-    SIDE = 3 * cm
-    TOP = 3 * cm
-    BOTTOM = 3 * cm
-    IMG = 3.2 * cm
-    CARD = 4.6 * cm
-
-    CONTENT_WIDTH = width - (SIDE * 2)
-    y = height - TOP
+    y = height - TOP_CM
     current_category = None
+    # Tarjetas de la página actual; se dibujan juntas al cerrar la página
+    cards = []
 
-    # ---------- PORTADA ----------
-    draw_background(c, width, height)
+    logo = load_logo(logo) if watermark else None
     if watermark:
-        draw_logo_watermark(c, width, height, logo_path)
-        draw_text_watermark(c, width, height)
+        define_watermark_form(c, width, height, logo)
+
+    # ---------- PORTADA ----------
+    draw_page_base(c, width, height, watermark)
 
     title = Paragraph("Tu catálogo está listo", title_style)
     title.wrapOn(c, width - 6 * cm, 3 * cm)
@@ -247,71 +552,46 @@ def generate_cata(
     draw_footer(c, width, whatsapp)
     c.showPage()
 
-    draw_background(c, width, height)
-    if watermark:
-        draw_logo_watermark(c, width, height, logo_path)
-        draw_text_watermark(c, width, height)
-    y = height - TOP
+    draw_page_base(c, width, height, watermark)
+    y = height - TOP_CM
 
     # ---------- PRODUCTOS ----------
     for category, name, price, image_url in data:
 
         if category != current_category:
             if current_category:
+                draw_cards(c, cards)
+                cards.clear()
                 draw_footer(c, width, whatsapp)
                 c.showPage()
-                draw_background(c, width, height)
-                if watermark:
-                    draw_logo_watermark(c, width, height, logo_path)
-                    draw_text_watermark(c, width, height)
-                y = height - TOP
+                draw_page_base(c, width, height, watermark)
+                y = height - TOP_CM
 
             c.setFillColor(GREEN)
-            c.roundRect(SIDE, y - 1.2 * cm, CONTENT_WIDTH, 1.4 * cm, 18, fill=1)
+            c.roundRect(SIDE_CM, y - CATEGORY_DY, CONTENT_WIDTH, CATEGORY_H, 18, fill=1)
             c.setFillColor(CREAM)
             c.setFont("Helvetica-Bold", 14)
-            c.drawString(SIDE + 1 * cm, y - 0.9 * cm, category)
+            c.drawString(CARD_IMG_X, y - CATEGORY_TEXT_DY, category)
 
-            y -= 2.4 * cm
+            y -= CATEGORY_STEP
             current_category = category
 
-        if y - CARD < BOTTOM:
+        if y - CARD_CM < BOTTOM_CM:
+            draw_cards(c, cards)
+            cards.clear()
             draw_footer(c, width, whatsapp)
             c.showPage()
-            draw_background(c, width, height)
-            if watermark:
-                draw_logo_watermark(c, width, height, logo_path)
-                draw_text_watermark(c, width, height)
-            y = height - TOP
-
-        c.setFillColor(GRAY)
-        c.roundRect(SIDE, y - CARD, CONTENT_WIDTH, CARD - 0.6 * cm, 20, fill=1)
-
-        img = get_image(image_url)
-        if img:
-            c.drawImage(img, SIDE + 1 * cm, y - IMG - 0.8 * cm, IMG, IMG, mask="auto")
-
-        c.setFillColor(TEXT)
-        c.setFont("Helvetica", 10)
-        c.drawString(SIDE + IMG + 2.2 * cm, y - 1.6 * cm, truncate(name))
+            draw_page_base(c, width, height, watermark)
+            y = height - TOP_CM
 
         price_text = f"${price:,.0f}" if price else "Precio por DM"
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(SIDE + IMG + 2.2 * cm, y - 2.7 * cm, price_text)
-
-        draw_button(
-            c,
-            SIDE + IMG + 2.2 * cm,
-            y - 4.1 * cm,
-            5 * cm,
-            1.3 * cm,
-            "Lo quiero",
-            whatsapp_link(name, price, whatsapp)
-        )
+        cards.append((y, image_forms.get(image_url), truncate(name), price_text, whatsapp_link(name, price, whatsapp)))
 
-        y -= CARD + 0.4 * cm
+        y -= CARD_STEP
 
+    draw_cards(c, cards)
     draw_footer(c, width, whatsapp)
     c.save()
+    os.replace(tmp_path, output_path)
 
     print("✅ CATA generado con éxito")
@@ -1,7 +1,9 @@
 import os
 import sqlite3
 import json
-from typing import Optional
+import threading
+import time
+from typing import Iterable, Optional, Pattern
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, "cata.db")
@@ -16,42 +18,104 @@ CREATE TABLE IF NOT EXISTS payments (
 """
 
 
+_conn: Optional[sqlite3.Connection] = None
+_conn_path: Optional[str] = None
+_lock = threading.Lock()
+
+
 def _get_conn():
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Conexión única del proceso (llamar con `_lock` tomado); se reabre si cambia DB_PATH."""
+    global _conn, _conn_path
+    if _conn is None or _conn_path != DB_PATH:
+        if _conn is not None:
+            _conn.close()
+        _conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False, isolation_level=None)
+        _conn.row_factory = sqlite3.Row
+        # WAL: las lecturas (is_paid) no se bloquean mientras mark_paid escribe
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn_path = DB_PATH
+    return _conn
 
 
 def init_db():
-    conn = _get_conn()
-    with conn:
-        conn.executescript(SCHEMA)
-    conn.close()
+    with _lock:
+        _get_conn().executescript(SCHEMA)
 
 
 def mark_paid(job_id: str, info: Optional[dict] = None):
-    conn = _get_conn()
-    with conn:
-        conn.execute(
+    with _lock:
+        _get_conn().execute(
             "INSERT OR REPLACE INTO payments (job_id, paid, ts, info) VALUES (?, 1, ?, ?)",
-            (job_id, float(__import__("time").time()), json.dumps(info or {}))
+            (job_id, time.time(), json.dumps(info or {}))
         )
-    conn.close()
 
 
 def is_paid(job_id: str) -> bool:
-    conn = _get_conn()
-    cur = conn.execute("SELECT paid FROM payments WHERE job_id = ?", (job_id,))
-    row = cur.fetchone()
-    conn.close()
+    with _lock:
+        row = _get_conn().execute("SELECT paid FROM payments WHERE job_id = ?", (job_id,)).fetchone()
     return bool(row and row["paid"]) 
 
 
 def get_payment(job_id: str):
-    conn = _get_conn()
-    cur = conn.execute("SELECT job_id, paid, ts, info FROM payments WHERE job_id = ?", (job_id,))
-    row = cur.fetchone()
-    conn.close()
+    with _lock:
+        row = _get_conn().execute("SELECT job_id, paid, ts, info FROM payments WHERE job_id = ?", (job_id,)).fetchone()
     if not row:
         return None
     return {"job_id": row["job_id"], "paid": bool(row["paid"]), "ts": row["ts"], "info": json.loads(row["info"] or "{}")}
+
+
+def cleanup_old_files(max_age_seconds: float, directories: Iterable[str], name_pattern: Optional[Pattern] = None) -> int:
+    """Borra los archivos de `directories` con más de `max_age_seconds` sin modificar; devuelve cuántos.
+    Con `name_pattern` solo se tocan los archivos cuyo nombre coincide."""
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    for directory in directories:
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if name_pattern is not None and not name_pattern.match(entry.name):
+                continue
+            try:
+                # scandir ya trae el stat en la mayoría de sistemas: un solo syscall por archivo
+                if entry.is_file(follow_symlinks=False) and entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                    os.unlink(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def enforce_size_limit(max_bytes: int, directory: str, name_pattern: Optional[Pattern] = None) -> int:
+    """Borra los archivos de `directory` usados hace más tiempo (atime) hasta que el total quepa en `max_bytes`.
+    Con `name_pattern` solo cuentan (y se borran) los archivos cuyo nombre coincide."""
+    files = []
+    total = 0
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        if name_pattern is not None and not name_pattern.match(entry.name):
+            continue
+        try:
+            if entry.is_file(follow_symlinks=False):
+                st = entry.stat(follow_symlinks=False)
+                files.append((st.st_atime, st.st_size, entry.path))
+                total += st.st_size
+        except FileNotFoundError:
+            pass
+    removed = 0
+    files.sort()
+    for _, size, path in files:
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        total -= size
+    return removed
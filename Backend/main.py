@@ -3,8 +3,8 @@ CATA - Generador de Catálogos PDF
 Backend optimizado con FastAPI
 """
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Depends
-from fastapi.responses import JSONResponse, FileResponse, RedirectResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Depends, BackgroundTasks
+from fastapi.responses import JSONResponse, FileResponse, RedirectResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
@@ -12,12 +12,23 @@ from typing import Optional, Dict, Any
 from pathlib import Path
 from datetime import datetime
 import os
-import uuid
+import time
+import re
+import secrets
+import tempfile
 import json
+import hashlib
+import pickle
 import base64
+import binascii
 import logging
 import asyncio
-from functools import lru_cache
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache, partial
+
+from serve import available_cpus
 
 # ==========================================
 # CONFIGURACIÓN Y LOGGING
@@ -35,22 +46,42 @@ class Config:
     PADDLE_VENDOR_AUTH_CODE: Optional[str] = os.getenv("PADDLE_VENDOR_AUTH_CODE")
     PADDLE_PUBLIC_KEY: Optional[str] = os.getenv("PADDLE_PUBLIC_KEY")
     PADDLE_WEBHOOK_TIMEOUT: int = 10
+    MAX_WEBHOOK_SIZE: int = 64 * 1024  # las alertas de Paddle ocupan unos pocos KB
     
     # Archivos
     BASE_DIR: Path = Path(__file__).parent.absolute()
     TMP_DIR: Path = BASE_DIR / "tmp"
     OUTPUT_DIR: Path = BASE_DIR / "output"
+    JOBS_DIR: Path = BASE_DIR / "jobs"  # datos preparados para el render diferido del PDF limpio
+    LOGOS_DIR: Path = BASE_DIR / "logos"  # logos ya procesados, por hash del archivo subido
     FRONTEND_DIR: Path = BASE_DIR.parent / "Frontend"
     
+    # CORS (lista separada por comas; "*" para cualquier origen)
+    ALLOWED_ORIGINS: tuple = tuple(
+        origin.strip() for origin in os.getenv("ALLOWED_ORIGINS", "*").split(",") if origin.strip()
+    )
+    
     # Límites de archivos
     MAX_CSV_SIZE: int = 5 * 1024 * 1024  # 5 MB
     MAX_LOGO_SIZE: int = 2 * 1024 * 1024  # 2 MB
+    CSV_MEMORY_LIMIT: int = 1024 * 1024  # CSVs hasta 1 MB se procesan en memoria, sin pasar por disco
     CHUNK_SIZE: int = 65536  # 64 KB
+    UPLOAD_COPY_CHUNK_SIZE: int = 1024 * 1024  # copia de subidas ya volcadas a disco, dentro de un hilo
+    MULTIPART_OVERHEAD: int = 64 * 1024  # cabeceras multipart y campo whatsapp de /generate
     
     # Precio del producto
     PRODUCT_PRICE: str = "USD:15.00"
     PRODUCT_TITLE: str = "CATA — Catálogo sin marca de agua"
     
+    # Procesos para el render de PDF (por defecto, uno por núcleo)
+    RENDER_WORKERS: int = max(1, int(os.getenv("RENDER_WORKERS", "0")) or available_cpus())
+    RENDER_MAX_TASKS_PER_CHILD: int = 200  # reciclar procesos acota el crecimiento de memoria
+    
+    # Caché HTTP de los PDFs servidos: el job_id es el hash del contenido, así que
+    # la URL de un PDF nunca cambia de contenido
+    PDF_CACHE_MAX_AGE: int = 31536000  # 1 año
+    PDF_CHUNK_SIZE: int = 256 * 1024  # menos lecturas en hilo por PDF que los 64 KB de Starlette
+    
     # Tipos de archivos permitidos
     ALLOWED_CSV_TYPES: set = {"text/csv", "application/vnd.ms-excel", "text/plain"}
     ALLOWED_LOGO_TYPES: set = {"image/png", "image/jpeg"}
@@ -58,12 +89,18 @@ class Config:
     # Limpieza automática
     CLEANUP_ENABLED: bool = os.getenv("CLEANUP_ENABLED", "true").lower() == "true"
     FILE_RETENTION_HOURS: int = int(os.getenv("FILE_RETENTION_HOURS", "24"))
+    TMP_RETENTION_MINUTES: int = 60  # subidas huérfanas de peticiones que fallaron a medias
+    CLEANUP_INTERVAL_SECONDS: int = 300
+    CLEANUP_FULL_SCAN_SECONDS: int = 3600  # escaneo completo de directorios; entre medias basta el registro
+    OUTPUT_MAX_MB: int = int(os.getenv("OUTPUT_MAX_MB", "1024"))  # tope de PDFs en disco (0 = sin tope); se borran los menos usados
 
     @classmethod
     def validate(cls) -> None:
         """Valida la configuración al inicio"""
         cls.TMP_DIR.mkdir(parents=True, exist_ok=True)
         cls.OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        cls.JOBS_DIR.mkdir(parents=True, exist_ok=True)
+        cls.LOGOS_DIR.mkdir(parents=True, exist_ok=True)
         
         if not cls.PADDLE_VENDOR_ID or not cls.PADDLE_VENDOR_AUTH_CODE:
             logging.warning("Paddle credentials not configured. Payment features will be disabled.")
@@ -86,32 +123,53 @@ logger = logging.getLogger("cata")
 # IMPORTACIONES OPCIONALES Y MÓDULOS
 # ==========================================
 
-# Crypto (opcional)
+# Crypto (opcional): cryptography verifica con OpenSSL; pycryptodome queda como respaldo
 HAS_CRYPTO = False
 try:
-    from Crypto.Hash import SHA1
-    from Crypto.PublicKey import RSA
-    from Crypto.Signature import PKCS1_v1_5
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import padding
+    HAS_CRYPTOGRAPHY = True
     HAS_CRYPTO = True
-    logger.info("Crypto library loaded successfully")
+    logger.info("cryptography library loaded successfully")
 except ImportError:
-    logger.warning(
-        "pycryptodome not installed. Paddle webhook verification disabled. "
-        "Install with: pip install pycryptodome"
-    )
+    HAS_CRYPTOGRAPHY = False
+    try:
+        from Crypto.Hash import SHA1
+        from Crypto.PublicKey import RSA
+        from Crypto.Signature import PKCS1_v1_5
+        HAS_CRYPTO = True
+        logger.info("Crypto library loaded successfully")
+    except ImportError:
+        logger.warning(
+            "Neither cryptography nor pycryptodome installed. Paddle webhook verification disabled. "
+            "Install with: pip install cryptography"
+        )
+
+# Clientes HTTP para la API de Paddle: httpx (asíncrono, conexión reutilizada) o requests
+HTTP_CLIENT_ERRORS: tuple = ()
+
+try:
+    import httpx
+    HAS_HTTPX = True
+    HTTP_CLIENT_ERRORS += (httpx.HTTPError,)
+except ImportError:
+    HAS_HTTPX = False
+    logger.warning("httpx not installed. Paddle API calls will use requests from a worker thread.")
 
-# Requests para API de Paddle
 try:
     import requests
     HAS_REQUESTS = True
+    HTTP_CLIENT_ERRORS += (requests.RequestException,)
 except ImportError:
     HAS_REQUESTS = False
-    logger.error("requests library not installed. Payment features disabled.")
+    if not HAS_HTTPX:
+        logger.error("requests library not installed. Payment features disabled.")
 
 # Módulos internos
 try:
-    from cata_pdf import generate_cata
-    from db import init_db, mark_paid, is_paid, cleanup_old_files
+    from cata_pdf import generate_cata, prepare_catalog, warm_up
+    from db import init_db, mark_paid, is_paid, cleanup_old_files, enforce_size_limit
     HAS_INTERNAL_MODULES = True
 except ImportError as e:
     HAS_INTERNAL_MODULES = False
@@ -126,35 +184,92 @@ class FileHandler:
     """Manejo seguro de archivos"""
     
     @staticmethod
-    async def save_upload_limited(
-        upload_file: UploadFile,
-        dest_path: Path,
-        max_bytes: int,
-        allowed_types: set
-    ) -> None:
-        """Guarda un archivo con límites de tamaño y validación de tipo"""
-        
-        # Validar tipo de contenido
+    def validate_content_type(upload_file: UploadFile, allowed_types: set) -> None:
         if upload_file.content_type not in allowed_types:
             raise HTTPException(
                 status_code=400,
                 detail=f"Invalid file type. Allowed: {', '.join(allowed_types)}"
             )
+    
+    @staticmethod
+    def too_large(max_bytes: int) -> HTTPException:
+        return HTTPException(
+            status_code=413,
+            detail=f"File exceeds maximum size of {max_bytes / (1024*1024):.1f} MB"
+        )
+    
+    @staticmethod
+    async def iter_upload_limited(
+        upload_file: UploadFile,
+        max_bytes: int,
+        allowed_types: set,
+        digest: Optional[Any] = None
+    ):
+        """Lee un archivo subido por bloques validando tipo y tamaño (y alimenta `digest` si se pasa)"""
+        FileHandler.validate_content_type(upload_file, allowed_types)
         
         total_bytes = 0
+        while chunk := await upload_file.read(Config.CHUNK_SIZE):
+            total_bytes += len(chunk)
+            # Comprobar antes de entregar el bloque: nunca se guarda más del límite
+            if total_bytes > max_bytes:
+                raise FileHandler.too_large(max_bytes)
+            if digest is not None:
+                digest.update(chunk)
+            yield chunk
+    
+    @staticmethod
+    async def read_upload_limited(
+        upload_file: UploadFile,
+        max_bytes: int,
+        allowed_types: set,
+        digest: Optional[Any] = None
+    ) -> bytes:
+        """Lee un archivo subido completo en memoria, con los mismos límites que `save_upload_limited`"""
+        data = bytearray()
+        try:
+            async for chunk in FileHandler.iter_upload_limited(upload_file, max_bytes, allowed_types, digest):
+                data += chunk
+        finally:
+            await upload_file.close()
+        
+        logger.info(f"Read file {upload_file.filename} ({len(data) / 1024:.1f} KB)")
+        return bytes(data)
+    
+    @staticmethod
+    def copy_spooled_upload(src, dest_path: Path, max_bytes: int, digest: Optional[Any] = None) -> int:
+        """Copia el archivo temporal de la subida a `dest_path` (bloqueante, para un hilo); devuelve los bytes"""
+        total_bytes = 0
+        src.seek(0)
+        with open(dest_path, "wb") as out:
+            while chunk := src.read(Config.UPLOAD_COPY_CHUNK_SIZE):
+                total_bytes += len(chunk)
+                if total_bytes > max_bytes:
+                    raise FileHandler.too_large(max_bytes)
+                if digest is not None:
+                    digest.update(chunk)
+                out.write(chunk)
+        return total_bytes
+    
+    @staticmethod
+    async def save_upload_limited(
+        upload_file: UploadFile,
+        dest_path: Path,
+        max_bytes: int,
+        allowed_types: set,
+        digest: Optional[Any] = None
+    ) -> None:
+        """Guarda un archivo con límites de tamaño y validación de tipo (y alimenta `digest` si se pasa)"""
+        
         try:
-            with open(dest_path, "wb") as out:
-                while chunk := await upload_file.read(Config.CHUNK_SIZE):
-                    total_bytes += len(chunk)
-                    if total_bytes > max_bytes:
-                        out.close()
-                        dest_path.unlink(missing_ok=True)
-                        raise HTTPException(
-                            status_code=413,
-                            detail=f"File exceeds maximum size of {max_bytes / (1024*1024):.1f} MB"
-                        )
-                    out.write(chunk)
+            FileHandler.validate_content_type(upload_file, allowed_types)
+            # El parser multipart ya volcó el cuerpo a un temporal: la copia (con el límite
+            # de tamaño y el hash) se hace en un solo viaje al hilo, no dos por bloque
+            total_bytes = await asyncio.to_thread(
+                FileHandler.copy_spooled_upload, upload_file.file, dest_path, max_bytes, digest
+            )
         except HTTPException:
+            dest_path.unlink(missing_ok=True)
             raise
         except Exception as e:
             dest_path.unlink(missing_ok=True)
@@ -165,70 +280,216 @@ class FileHandler:
         
         logger.info(f"Saved file {dest_path.name} ({total_bytes / 1024:.1f} KB)")
     
+    @staticmethod
+    def pdf_response(
+        request: Request,
+        file_path: Path,
+        filename: str,
+        disposition: str = "attachment",
+        public: bool = True
+    ) -> Response:
+        """Sirve un PDF con ETag y Cache-Control; responde 304 si el cliente ya tiene esta versión"""
+        try:
+            stat = file_path.stat()
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="PDF not found")
+        
+        etag = f'W/"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        # Marca el acceso para el tope de tamaño (LRU por atime); mtime no cambia, así que el ETag tampoco
+        try:
+            os.utime(file_path, ns=(time.time_ns(), stat.st_mtime_ns))
+        except OSError:
+            pass
+        headers = {
+            "ETag": etag,
+            # El visor del iframe pide el PDF por rangos y muestra la primera página sin esperar al resto
+            "Accept-Ranges": "bytes",
+            "Cache-Control": f"{'public' if public else 'private'}, max-age={Config.PDF_CACHE_MAX_AGE}, immutable",
+        }
+        
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            if "*" in tags or etag.removeprefix("W/") in tags:
+                return Response(status_code=304, headers=headers)
+        
+        headers["Content-Disposition"] = f"{disposition}; filename=\"{filename}\""
+        # stat_result evita un segundo stat en un hilo al enviar el archivo
+        response = FileResponse(
+            path=str(file_path),
+            stat_result=stat,
+            media_type="application/pdf",
+            headers=headers
+        )
+        response.chunk_size = Config.PDF_CHUNK_SIZE
+        return response
+    
     @staticmethod
     def cleanup_temp_files(*paths: Path) -> None:
         """Limpia archivos temporales de forma segura"""
         for path in paths:
             try:
-                if path and path.exists():
-                    path.unlink()
+                if path:
+                    path.unlink(missing_ok=True)
                     logger.debug(f"Cleaned up temp file: {path.name}")
             except Exception as e:
                 logger.warning(f"Failed to cleanup {path}: {e}")
 
 
+# Nombres que genera la propia app (hash o token hex de 32 caracteres, más los temporales
+# de escritura atómica). El limpiador no toca nada más de esos directorios.
+APP_FILE_PATTERN = re.compile(
+    r"(CATA_)?[0-9a-f]{32}(_watermark)?(\.(csv|pdf|pkl|png))?(\.[^.]+\.tmp)?"
+)
+
+
+class KnownFiles:
+    """Registro en memoria de los archivos que escribe la app y cuándo caducan.
+    El limpiador periódico lo consulta sin tocar el disco; el escaneo completo
+    de directorios (archivos de antes de un reinicio, etc.) se hace con menos frecuencia."""
+    
+    def __init__(self):
+        self._expiry: Dict[Path, float] = {}
+    
+    def add(self, path: Path, ttl_seconds: float) -> None:
+        self._expiry[path] = time.time() + ttl_seconds
+    
+    def touch(self, path: Path, ttl_seconds: float) -> bool:
+        """Renueva mtime y caducidad de un archivo que se reutiliza; False si ya no existe."""
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        self.add(path, ttl_seconds)
+        return True
+    
+    def pop_expired(self) -> list:
+        now = time.time()
+        expired = [path for path, expiry in self._expiry.items() if expiry <= now]
+        for path in expired:
+            del self._expiry[path]
+        return expired
+    
+    def __len__(self) -> int:
+        return len(self._expiry)
+
+
+known_files = KnownFiles()
+
+
 class PaddleWebhookVerifier:
     """Verificador de firmas de webhooks de Paddle"""
     
     def __init__(self, public_key: Optional[str]):
         self.public_key = public_key
-        self.enabled = HAS_CRYPTO and public_key
+        self.verifier = None
         
+        # Cargar la clave pública una sola vez (PEM en línea o ruta a archivo)
+        if HAS_CRYPTO and public_key:
+            try:
+                if public_key.strip().startswith("-----BEGIN"):
+                    pem = public_key.encode("utf-8")
+                else:
+                    with open(public_key, "rb") as f:
+                        pem = f.read()
+                if HAS_CRYPTOGRAPHY:
+                    self.verifier = serialization.load_pem_public_key(pem)
+                else:
+                    self.verifier = PKCS1_v1_5.new(RSA.import_key(pem))
+            except Exception as e:
+                logger.error(f"Invalid Paddle public key: {e}")
+        
+        self.enabled = self.verifier is not None
         if not self.enabled:
             logger.warning("Paddle webhook verification disabled")
     
+    @staticmethod
+    def serialize_payload(payload: Dict[str, Any]) -> bytes:
+        """Serializa el payload como lo firma Paddle: valores concatenados en orden de clave"""
+        return b"".join(
+            (
+                json.dumps(value, separators=(",", ":"), sort_keys=True)
+                if isinstance(value, (list, dict)) else str(value)
+            ).encode("utf-8")
+            for _, value in sorted(payload.items())
+        )
+    
     def verify_signature(self, payload: Dict[str, Any], signature: str) -> bool:
         """Verifica la firma de un webhook de Paddle"""
-        if not self.enabled:
+        if not self.enabled or not signature:
             return False
         
         try:
-            # Preparar datos para verificación
-            sorted_items = sorted(payload.items())
-            serialized = b""
-            
-            for key, value in sorted_items:
-                if isinstance(value, (list, dict)):
-                    string_val = json.dumps(value, separators=(",", ":"), sort_keys=True)
-                else:
-                    string_val = str(value)
-                serialized += string_val.encode("utf-8")
-            
-            # Decodificar firma
-            signature_bytes = base64.b64decode(signature)
-            
-            # Cargar clave pública
-            if self.public_key.strip().startswith("-----BEGIN"):
-                key = RSA.import_key(self.public_key)
-            else:
-                with open(self.public_key, "rb") as f:
-                    key = RSA.import_key(f.read())
-            
-            # Verificar
-            verifier = PKCS1_v1_5.new(key)
-            digest = SHA1.new(serialized)
-            
-            return verifier.verify(digest, signature_bytes)
-            
-        except Exception as e:
-            logger.error(f"Error verifying webhook signature: {e}")
+            signature_bytes = base64.b64decode(signature, validate=True)
+        except (binascii.Error, ValueError):
+            logger.warning("Malformed webhook signature")
+            return False
+        
+        # Solo los errores de la verificación criptográfica cuentan como firma inválida;
+        # cualquier otro fallo es un bug y debe terminar en 500
+        message = self.serialize_payload(payload)
+        try:
+            if HAS_CRYPTOGRAPHY:
+                try:
+                    self.verifier.verify(signature_bytes, message, padding.PKCS1v15(), hashes.SHA1())
+                except InvalidSignature:
+                    return False
+                return True
+            return self.verifier.verify(SHA1.new(message), signature_bytes)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Webhook signature rejected: {e}")
             return False
 
 
+class BodySizeLimitMiddleware:
+    """Middleware ASGI: responde 413 según el Content-Length declarado, antes de que
+    el parser multipart vuelque la subida a disco. Los límites por archivo del
+    handler siguen aplicándose a los cuerpos sin Content-Length (chunked)."""
+    
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            max_bytes = self.limits.get(scope["path"])
+            if max_bytes is not None:
+                for name, value in scope["headers"]:
+                    if name == b"content-length":
+                        if value.isdigit() and int(value) > max_bytes:
+                            response = JSONResponse(status_code=413, content={"detail": "Payload too large"})
+                            await response(scope, receive, send)
+                            return
+                        break
+        await self.app(scope, receive, send)
+
+
+@lru_cache(maxsize=4)
+def get_webhook_verifier(public_key: Optional[str]) -> PaddleWebhookVerifier:
+    """Verificador por clave pública: la clave se parsea una vez, no en cada webhook"""
+    return PaddleWebhookVerifier(public_key)
+
+
 # ==========================================
 # CICLO DE VIDA DE LA APLICACIÓN
 # ==========================================
 
+def create_render_pool() -> ProcessPoolExecutor:
+    """Pool de procesos para el render de PDF (CPU-bound, no escala con hilos por el GIL).
+    "spawn" evita hacer fork de un proceso que ya tiene hilos del servidor.
+    Cada proceso importa cata_pdf y se calienta (warm_up) al arrancar, no con el primer trabajo."""
+    pool = ProcessPoolExecutor(
+        max_workers=Config.RENDER_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=warm_up if HAS_INTERNAL_MODULES else None,
+        max_tasks_per_child=Config.RENDER_MAX_TASKS_PER_CHILD
+    )
+    # Los procesos se crean bajo demanda: una tarea vacía por worker los lanza ya
+    for _ in range(Config.RENDER_WORKERS):
+        pool.submit(os.getpid)
+    return pool
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Manejo del ciclo de vida de la aplicación"""
@@ -240,15 +501,49 @@ async def lifespan(app: FastAPI):
         init_db()
         logger.info("Database initialized")
     
+    app.state.pool = create_render_pool()
+    logger.info(f"Render pool started ({Config.RENDER_WORKERS} workers)")
+    
+    # Cliente HTTP compartido: keep-alive con Paddle, sin un handshake TLS por checkout
+    app.state.http = None
+    if HAS_HTTPX:
+        app.state.http = httpx.AsyncClient(
+            timeout=Config.PADDLE_WEBHOOK_TIMEOUT,
+            limits=httpx.Limits(max_keepalive_connections=20)
+        )
+    
     # Tarea de limpieza periódica (si está habilitada)
     cleanup_task = None
     if Config.CLEANUP_ENABLED and HAS_INTERNAL_MODULES:
+        def full_sweep() -> int:
+            removed = cleanup_old_files(
+                Config.TMP_RETENTION_MINUTES * 60, [Config.TMP_DIR], APP_FILE_PATTERN
+            )
+            removed += cleanup_old_files(
+                Config.FILE_RETENTION_HOURS * 3600,
+                [Config.OUTPUT_DIR, Config.JOBS_DIR, Config.LOGOS_DIR],
+                APP_FILE_PATTERN
+            )
+            if Config.OUTPUT_MAX_MB:
+                removed += enforce_size_limit(
+                    Config.OUTPUT_MAX_MB * 1024 * 1024, Config.OUTPUT_DIR, APP_FILE_PATTERN
+                )
+            return removed
+        
         async def periodic_cleanup():
+            last_full_scan = 0.0
             while True:
-                await asyncio.sleep(3600)  # Cada hora
+                await asyncio.sleep(Config.CLEANUP_INTERVAL_SECONDS)
                 try:
-                    cleanup_old_files(Config.FILE_RETENTION_HOURS)
-                    logger.info("Periodic cleanup completed")
+                    if time.monotonic() - last_full_scan >= Config.CLEANUP_FULL_SCAN_SECONDS:
+                        removed = await asyncio.to_thread(full_sweep)
+                        last_full_scan = time.monotonic()
+                        logger.info(f"Periodic cleanup completed ({removed} files removed, full scan)")
+                    else:
+                        expired = known_files.pop_expired()
+                        if expired:
+                            await asyncio.to_thread(FileHandler.cleanup_temp_files, *expired)
+                            logger.info(f"Periodic cleanup completed ({len(expired)} files removed)")
                 except Exception as e:
                     logger.error(f"Periodic cleanup failed: {e}")
         
@@ -267,6 +562,9 @@ async def lifespan(app: FastAPI):
             await cleanup_task
         except asyncio.CancelledError:
             pass
+    if app.state.http is not None:
+        await app.state.http.aclose()
+    app.state.pool.shutdown(wait=True)
     logger.info("CATA API stopped")
 
 
@@ -281,13 +579,22 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Rechazo temprano de cuerpos demasiado grandes. Se registra antes que CORS para quedar
+# por dentro: así el 413 también lleva las cabeceras CORS y el frontend puede leerlo.
+# /webhook/paddle lo comprueba en el propio handler (además exige Content-Length).
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    limits={"/generate": Config.MAX_CSV_SIZE + Config.MAX_LOGO_SIZE + Config.MULTIPART_OVERHEAD},
+)
+
 # Middleware CORS
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=os.getenv("ALLOWED_ORIGINS", "*").split(","),
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=Config.ALLOWED_ORIGINS,
+    # El frontend no usa cookies: sin credenciales, "*" se responde como cabecera fija
+    allow_credentials=False,
+    allow_methods=["GET", "POST"],
+    allow_headers=["Content-Type"],
 )
 
 # Montar archivos estáticos
@@ -307,15 +614,91 @@ if Config.FRONTEND_DIR.exists():
 # ENDPOINTS PRINCIPALES
 # ==========================================
 
+async def paddle_post(url: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """POST a la API de Paddle con el cliente de la app (o con requests en un hilo si no hay httpx)"""
+    http = getattr(app.state, "http", None)
+    if http is not None:
+        response = await http.post(url, data=data)
+    else:
+        response = await asyncio.to_thread(
+            requests.post, url, data=data, timeout=Config.PADDLE_WEBHOOK_TIMEOUT
+        )
+    response.raise_for_status()
+    try:
+        return response.json()
+    except ValueError:
+        # httpx y requests lanzan JSONDecodeError (subclase de ValueError) con un cuerpo que no es JSON
+        logger.error(f"Paddle API returned a non-JSON response ({response.status_code})")
+        raise HTTPException(status_code=502, detail="Failed to connect to payment gateway")
+
+
+async def run_in_pool(func, **kwargs):
+    """Ejecuta `func` en el pool de procesos de la app (o en un hilo si no se inició el lifespan)."""
+    loop = asyncio.get_running_loop()
+    pool = getattr(app.state, "pool", None)
+    try:
+        return await loop.run_in_executor(pool, partial(func, **kwargs))
+    except BrokenProcessPool:
+        # Un worker murió (OOM, segfault) y el pool ya no acepta tareas: se sustituye
+        # una sola vez (otras peticiones pueden haberlo hecho ya) y se reintenta
+        if app.state.pool is pool:
+            logger.error("Render pool broken, starting a new one")
+            app.state.pool = create_render_pool()
+            pool.shutdown(wait=False, cancel_futures=True)
+        return await loop.run_in_executor(app.state.pool, partial(func, **kwargs))
+
+
+def save_job_inputs(path: Path, products, images, whatsapp: str) -> None:
+    """Guarda productos e imágenes ya preparados para renderizar el PDF limpio más tarde"""
+    # Nombre temporal único: reenvíos de la misma subida comparten job_id y escriben a la vez
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f"{path.stem}.", suffix=".tmp", delete=False) as f:
+        pickle.dump((products, images, whatsapp), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f.name, path)
+
+
+def load_job_inputs(path: Path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+# Renders del PDF limpio en curso: descargas simultáneas del mismo job esperan al mismo render
+_clean_renders: Dict[str, "asyncio.Future"] = {}
+
+
+async def render_clean_pdf(job_id: str, config: Config) -> None:
+    """Renderiza el PDF sin marca a partir de los datos guardados en /generate"""
+    inputs_path = config.JOBS_DIR / f"{job_id}.pkl"
+    if not inputs_path.exists():
+        raise HTTPException(status_code=404, detail="PDF not found")
+    
+    logger.info(f"Job {job_id}: Generating clean PDF")
+    products, images, whatsapp = await asyncio.to_thread(load_job_inputs, inputs_path)
+    pdf_clean = config.OUTPUT_DIR / f"CATA_{job_id}.pdf"
+    await run_in_pool(
+        generate_cata,
+        data=products,
+        images=images,
+        logo=None,
+        whatsapp=whatsapp,
+        output_path=str(pdf_clean),
+        watermark=False
+    )
+    known_files.add(pdf_clean, config.FILE_RETENTION_HOURS * 3600)
+    # Los datos preparados se conservan hasta que caduquen: si el tope de tamaño
+    # expulsa el PDF limpio, la siguiente descarga pagada lo vuelve a renderizar
+
+
 @app.post("/generate", response_class=JSONResponse)
 async def generate_catalog(
+    background: BackgroundTasks,
     csv: UploadFile = File(..., description="Archivo CSV con productos"),
     logo: UploadFile = File(..., description="Logo de la empresa (PNG/JPEG)"),
     whatsapp: str = Form(..., description="Número de WhatsApp para contacto"),
     config: Config = Depends(get_config)
 ) -> Dict[str, str]:
     """
-    Genera un catálogo PDF con marca de agua (preview) y sin marca (versión completa).
+    Genera el catálogo PDF con marca de agua (preview). La versión sin marca
+    se renderiza en la primera descarga tras el pago.
     
     Returns:
         - job_id: Identificador único del trabajo
@@ -330,78 +713,112 @@ async def generate_catalog(
             detail="Service temporarily unavailable. Internal modules not loaded."
         )
     
-    job_id = str(uuid.uuid4())
-    logger.info(f"Starting job {job_id}")
+    upload_id = secrets.token_hex(16)
     
-    # Rutas de archivos
-    csv_path = config.TMP_DIR / f"{job_id}.csv"
-    logo_path = config.TMP_DIR / f"{job_id}_logo{Path(logo.filename).suffix}"
-    pdf_watermark = config.OUTPUT_DIR / f"CATA_{job_id}_watermark.pdf"
-    pdf_clean = config.OUTPUT_DIR / f"CATA_{job_id}.pdf"
+    # Solo los CSV grandes pasan por disco; el resto de la subida se queda en memoria
+    csv_path = config.TMP_DIR / f"{upload_id}.csv"
     
     try:
         # Validar número de WhatsApp
         if not whatsapp.strip():
             raise HTTPException(status_code=400, detail="WhatsApp number is required")
         
-        # Guardar archivos
-        logger.info(f"Job {job_id}: Saving uploaded files")
-        await FileHandler.save_upload_limited(
-            csv, csv_path, config.MAX_CSV_SIZE, config.ALLOWED_CSV_TYPES
-        )
-        await FileHandler.save_upload_limited(
-            logo, logo_path, config.MAX_LOGO_SIZE, config.ALLOWED_LOGO_TYPES
-        )
-        
-        # Generar PDF con marca de agua
-        logger.info(f"Job {job_id}: Generating watermarked PDF")
-        await asyncio.to_thread(
-            generate_cata,
-            csv_path=str(csv_path),
-            logo_path=str(logo_path),
-            whatsapp=whatsapp.strip(),
-            output_path=str(pdf_watermark),
-            watermark=True
-        )
-        
-        # Generar PDF limpio
-        logger.info(f"Job {job_id}: Generating clean PDF")
-        await asyncio.to_thread(
-            generate_cata,
-            csv_path=str(csv_path),
-            logo_path=str(logo_path),
-            whatsapp=whatsapp.strip(),
-            output_path=str(pdf_clean),
-            watermark=False
+        # Leer archivos calculando su hash al vuelo
+        csv_digest = hashlib.blake2b(digest_size=16)
+        logo_digest = hashlib.blake2b(digest_size=16)
+        if csv.size is not None and csv.size <= config.CSV_MEMORY_LIMIT:
+            csv_source = await FileHandler.read_upload_limited(
+                csv, config.MAX_CSV_SIZE, config.ALLOWED_CSV_TYPES, csv_digest
+            )
+        else:
+            await FileHandler.save_upload_limited(
+                csv, csv_path, config.MAX_CSV_SIZE, config.ALLOWED_CSV_TYPES, csv_digest
+            )
+            csv_source = str(csv_path)
+            known_files.add(csv_path, config.TMP_RETENTION_MINUTES * 60)
+            # Se borra después de enviar la respuesta, fuera del camino crítico
+            background.add_task(FileHandler.cleanup_temp_files, csv_path)
+        logo_bytes = await FileHandler.read_upload_limited(
+            logo, config.MAX_LOGO_SIZE, config.ALLOWED_LOGO_TYPES, logo_digest
         )
         
-        logger.info(f"Job {job_id}: Completed successfully")
+        # El job_id es el hash del contenido: la misma subida reutiliza los PDFs ya generados
+        key = hashlib.blake2b(digest_size=16)
+        key.update(csv_digest.digest())
+        key.update(logo_digest.digest())
+        key.update(whatsapp.strip().encode("utf-8"))
+        job_id = key.hexdigest()
         
-        return {
+        pdf_watermark = config.OUTPUT_DIR / f"CATA_{job_id}_watermark.pdf"
+        pdf_clean = config.OUTPUT_DIR / f"CATA_{job_id}.pdf"
+        job_inputs = config.JOBS_DIR / f"{job_id}.pkl"
+        result = {
             "job_id": job_id,
             "pdf_preview": f"/download/{job_id}?watermark=1",
             "pdf_clean": f"/download/{job_id}?watermark=0",
             "preview_url": f"/Frontend/preview.html?job={job_id}"
         }
         
+        # Reutilizar cuenta como uso: sin renovar mtime, el barrido los borraría por antigüedad
+        retention = config.FILE_RETENTION_HOURS * 3600
+        reused = {path: known_files.touch(path, retention) for path in (pdf_watermark, pdf_clean, job_inputs)}
+        if reused[pdf_watermark] and (reused[pdf_clean] or reused[job_inputs]):
+            logger.info(f"Job {job_id}: Reusing previously generated PDFs")
+            return result
+        
+        logger.info(f"Starting job {job_id}")
+        
+        # Cargar productos, imágenes y logo una sola vez
+        logger.info(f"Job {job_id}: Loading products and images")
+        # Logos idénticos (mismo hash) se procesan una sola vez entre trabajos
+        logo_cache = config.LOGOS_DIR / f"{logo_digest.hexdigest()}.png"
+        products, images, logo_png = await asyncio.to_thread(
+            prepare_catalog, csv_source, logo_bytes, str(logo_cache)
+        )
+
+        # Solo el PDF con marca; el limpio se genera si el job llega a pagarse
+        logger.info(f"Job {job_id}: Generating watermarked PDF")
+        await asyncio.gather(
+            run_in_pool(
+                generate_cata,
+                data=products,
+                images=images,
+                logo=logo_png,
+                whatsapp=whatsapp.strip(),
+                output_path=str(pdf_watermark),
+                watermark=True
+            ),
+            asyncio.to_thread(save_job_inputs, job_inputs, products, images, whatsapp.strip())
+        )
+        
+        for path in (pdf_watermark, job_inputs, logo_cache):
+            known_files.add(path, retention)
+        
+        logger.info(f"Job {job_id}: Completed successfully")
+        
+        return result
+        
     except HTTPException:
+        # Las tareas en segundo plano no corren si la petición falla: limpiar ya
+        FileHandler.cleanup_temp_files(csv_path)
         raise
-    except Exception as e:
-        logger.exception(f"Job {job_id}: Generation failed")
-        raise HTTPException(status_code=500, detail=f"PDF generation failed: {str(e)}")
-    finally:
-        # Limpieza de archivos temporales
-        FileHandler.cleanup_temp_files(csv_path, logo_path)
+    except Exception:
+        FileHandler.cleanup_temp_files(csv_path)
+        logger.exception(f"Upload {upload_id}: Generation failed")
+        # El detalle queda en el log; al cliente solo la referencia para encontrarlo
+        raise HTTPException(status_code=500, detail=f"PDF generation failed (ref {upload_id})")
 
 
 @app.get("/download/{job_id}")
 async def download_pdf(
+    request: Request,
     job_id: str,
     watermark: int = 1,
     config: Config = Depends(get_config)
-) -> FileResponse:
+) -> Response:
     """
-    Descarga el PDF generado.
+    Descarga el PDF generado. La versión limpia requiere pago y se renderiza
+    la primera vez que se pide.
     
     Args:
         job_id: ID del trabajo
@@ -409,38 +826,47 @@ async def download_pdf(
     """
     
     filename = f"CATA_{job_id}_watermark.pdf" if watermark == 1 else f"CATA_{job_id}.pdf"
-    file_path = config.OUTPUT_DIR / filename
     
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="PDF not found")
+    if watermark != 1:
+        if not HAS_INTERNAL_MODULES:
+            raise HTTPException(status_code=503, detail="Service unavailable")
+        if not await asyncio.to_thread(is_paid, job_id):
+            raise HTTPException(status_code=402, detail="Payment required")
+        
+        if not (config.OUTPUT_DIR / filename).exists():
+            render = _clean_renders.get(job_id)
+            if render is None:
+                render = asyncio.ensure_future(render_clean_pdf(job_id, config))
+                _clean_renders[job_id] = render
+                render.add_done_callback(lambda _: _clean_renders.pop(job_id, None))
+            try:
+                await asyncio.shield(render)
+            except HTTPException:
+                raise
+            except Exception:
+                logger.exception(f"Job {job_id}: Clean PDF generation failed")
+                raise HTTPException(status_code=500, detail="PDF generation failed")
     
-    return FileResponse(
-        path=str(file_path),
-        media_type="application/pdf",
-        filename=filename,
-        headers={"Content-Disposition": f"attachment; filename=\"{filename}\""}
+    # La versión limpia es de pago: solo cachés privadas (navegador), nunca CDN
+    return FileHandler.pdf_response(
+        request, config.OUTPUT_DIR / filename, filename, public=watermark == 1
     )
 
 
 @app.get("/preview/{job_id}")
 async def preview_pdf(
+    request: Request,
     job_id: str,
     config: Config = Depends(get_config)
-) -> FileResponse:
+) -> Response:
     """
     Muestra el PDF con marca de agua en el navegador (inline).
     """
     
     filename = f"CATA_{job_id}_watermark.pdf"
-    file_path = config.OUTPUT_DIR / filename
     
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="PDF not found")
-    
-    return FileResponse(
-        path=str(file_path),
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"inline; filename=\"{filename}\""}
+    return FileHandler.pdf_response(
+        request, config.OUTPUT_DIR / filename, filename, disposition="inline"
     )
 
 
@@ -457,7 +883,7 @@ async def create_checkout(
     Crea un link de pago de Paddle para desbloquear el PDF sin marca de agua.
     """
     
-    if not HAS_REQUESTS:
+    if not (HAS_HTTPX or HAS_REQUESTS):
         raise HTTPException(status_code=503, detail="Payment service unavailable")
     
     if not config.PADDLE_VENDOR_ID or not config.PADDLE_VENDOR_AUTH_CODE:
@@ -476,13 +902,10 @@ async def create_checkout(
     }
     
     try:
-        response = requests.post(
+        data = await paddle_post(
             "https://vendors.paddle.com/api/2.0/product/generate_pay_link",
-            data=payload,
-            timeout=config.PADDLE_WEBHOOK_TIMEOUT
+            data=payload
         )
-        response.raise_for_status()
-        data = response.json()
         
         if not data.get("success"):
             logger.error(f"Paddle API error: {data}")
@@ -496,7 +919,7 @@ async def create_checkout(
         
         return {"url": checkout_url}
         
-    except requests.RequestException as e:
+    except HTTP_CLIENT_ERRORS as e:
         logger.error(f"Paddle API request failed: {e}")
         raise HTTPException(
             status_code=502,
@@ -516,6 +939,14 @@ async def paddle_webhook(
     if not HAS_INTERNAL_MODULES:
         raise HTTPException(status_code=503, detail="Service unavailable")
     
+    # Rechazar cuerpos grandes antes de que request.form() los cargue en memoria
+    try:
+        content_length = int(request.headers["content-length"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=411, detail="Content-Length required")
+    if content_length > config.MAX_WEBHOOK_SIZE:
+        raise HTTPException(status_code=413, detail="Payload too large")
+    
     # Obtener datos del formulario
     form = await request.form()
     payload = {k: v for k, v in form.items()}
@@ -523,7 +954,7 @@ async def paddle_webhook(
     signature = payload.pop("p_signature", None)
     
     # Verificar firma
-    verifier = PaddleWebhookVerifier(config.PADDLE_PUBLIC_KEY)
+    verifier = get_webhook_verifier(config.PADDLE_PUBLIC_KEY)
     
     if not verifier.verify_signature(payload, signature):
         logger.warning(f"Invalid webhook signature from {request.client.host}")
@@ -534,7 +965,8 @@ async def paddle_webhook(
     passthrough = payload.get("passthrough")
     
     if alert_name and "payment" in alert_name.lower() and passthrough:
-        mark_paid(passthrough, info=payload)
+        # SQLite bloquea: fuera del event loop
+        await asyncio.to_thread(mark_paid, passthrough, info=payload)
         logger.info(f"Marked job {passthrough} as paid (alert: {alert_name})")
     
     return {"status": "ok"}
@@ -552,7 +984,7 @@ async def payment_status(
     if not HAS_INTERNAL_MODULES:
         raise HTTPException(status_code=503, detail="Service unavailable")
     
-    paid = is_paid(job)
+    paid = await asyncio.to_thread(is_paid, job)
     
     response = {"paid": paid}
     if paid:
@@ -574,11 +1006,14 @@ async def health_check() -> Dict[str, Any]:
         "version": "2.0.0",
         "modules": {
             "crypto": HAS_CRYPTO,
+            "cryptography": HAS_CRYPTOGRAPHY,
+            "httpx": HAS_HTTPX,
             "requests": HAS_REQUESTS,
             "internal": HAS_INTERNAL_MODULES
         },
         "config": {
             "paddle_configured": bool(Config.PADDLE_VENDOR_ID and Config.PADDLE_VENDOR_AUTH_CODE),
+            "render_workers": Config.RENDER_WORKERS,
             "cleanup_enabled": Config.CLEANUP_ENABLED
         }
     }
@@ -593,6 +1028,7 @@ async def metrics(config: Config = Depends(get_config)) -> Dict[str, Any]:
     
     return {
         "files": {
+            "tracked_count": len(known_files),
             "output_count": len(output_files),
             "temp_count": len(temp_files),
             "output_size_mb": sum(f.stat().st_size for f in output_files) / (1024 * 1024),
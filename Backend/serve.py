@@ -0,0 +1,47 @@
+"""
+Arranque de producción: Uvicorn con varios procesos y uvloop/httptools.
+Para desarrollo sigue valiendo `uvicorn main:app --reload`.
+"""
+
+import os
+
+import uvicorn
+
+
+def available_cpus() -> int:
+    """Núcleos que puede usar este proceso: afinidad y, en contenedores, la cuota de CPU (cgroup v2).
+    os.cpu_count() devuelve los núcleos del host aunque el contenedor tenga límite."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # macOS / Windows
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def main() -> None:
+    cpus = available_cpus()
+    # Por defecto pocos procesos web: cada uno carga reportlab/Pillow y su propio pool de render
+    workers = max(1, int(os.getenv("WEB_CONCURRENCY", "0")) or min(cpus, 2))
+    # Cada proceso web tiene su propio pool de render: repartir los núcleos entre ellos
+    os.environ.setdefault("RENDER_WORKERS", str(max(1, cpus // workers)))
+
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=workers,
+        loop="auto",  # uvloop si está instalado (uvicorn[standard])
+        http="auto",  # httptools si está instalado
+        log_level=os.getenv("LOG_LEVEL", "INFO").lower(),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,7 @@ from PIL import Image, ImageDraw
 import io
 
 API = "http://127.0.0.1:8000/generate"
-CSV_PATH = "./tmp/151c2598-dba1-40d8-af47-26983ddad026.csv"
+CSV_PATH = "./samples/catalogo_ejemplo.csv"
 
 
 def run():
@@ -0,0 +1,51 @@
+import io
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import db as db_module
+import main
+
+# No image URLs: rendering never touches the network
+CSV_BYTES = (
+    "category,name,price,image\n"
+    "Bebidas,Jugo de naranja,4500,\n"
+    "Bebidas,Limonada,\"3,5\",\n"
+    "Postres,Brownie,12000,\n"
+).encode("utf-8")
+
+
+def make_logo() -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGBA", (64, 64), (34, 197, 94, 255)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """App with its own database and data directories, lifespan (render pool) included."""
+    monkeypatch.setattr(db_module, "DB_PATH", str(tmp_path / "cata.db"))
+    for name in ("TMP_DIR", "OUTPUT_DIR", "JOBS_DIR", "LOGOS_DIR"):
+        monkeypatch.setattr(main.Config, name, tmp_path / name.lower())
+    monkeypatch.setattr(main.Config, "RENDER_WORKERS", 1)
+    with TestClient(main.app) as c:
+        yield c
+
+
+@pytest.fixture
+def generate(client):
+    """POST /generate with the sample CSV and logo; returns the response."""
+    logo = make_logo()
+
+    def post(csv_bytes=CSV_BYTES, whatsapp="+57 300 123 4567", csv_type="text/csv"):
+        return client.post(
+            "/generate",
+            files={
+                "csv": ("products.csv", csv_bytes, csv_type),
+                "logo": ("logo.png", logo, "image/png"),
+            },
+            data={"whatsapp": whatsapp},
+        )
+
+    return post
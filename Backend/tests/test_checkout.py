@@ -0,0 +1,17 @@
+import httpx
+
+import main
+
+
+def test_checkout_non_json_gateway_response_is_502(client, monkeypatch):
+    monkeypatch.setattr(main.Config, "PADDLE_VENDOR_ID", "123")
+    monkeypatch.setattr(main.Config, "PADDLE_VENDOR_AUTH_CODE", "secret")
+
+    async def fake_post(url, data):
+        return httpx.Response(200, text="<html>maintenance</html>", request=httpx.Request("POST", url))
+
+    monkeypatch.setattr(main.app.state.http, "post", fake_post)
+
+    r = client.get("/checkout?job=abc")
+    assert r.status_code == 502
+    assert r.json()["detail"] == "Failed to connect to payment gateway"
@@ -0,0 +1,63 @@
+import pytest
+
+import cata_pdf
+
+BACKENDS = [
+    pytest.param(True, id="arrow", marks=pytest.mark.skipif(not cata_pdf.HAS_ARROW, reason="pyarrow not installed")),
+    pytest.param(False, id="csv"),
+]
+
+# BOM, Spanish headers, quoted newline, padded values, skipped rows, odd prices
+REGULAR_CSV = (
+    "\ufeffcategoria,nombre,precio,imagen\n"
+    "Bebidas, Jugo de naranja ,\"$ 2,5\",http://img/a.jpg\n"
+    "Postres,\"Torta\nde chocolate\",1.500,\n"
+    "Bebidas,Agua,15000, \n"
+    ",Sin categoría,100,\n"
+    "Snacks,,100,\n"
+    "Snacks,Papas,abc,\n"
+    "Snacks,Maní,,\n"
+)
+REGULAR_EXPECTED = [
+    ("Bebidas", "Jugo de naranja", 2.5, "http://img/a.jpg"),
+    ("Bebidas", "Agua", 15000.0, ""),
+    ("Postres", "Torta\nde chocolate", 1.5, ""),
+    ("Snacks", "Papas", None, ""),
+    ("Snacks", "Maní", None, ""),
+]
+
+# Rows with more or fewer columns than the header (pyarrow rejects them, csv.reader takes over)
+RAGGED_CSV = (
+    "category,name,price\n"
+    "A,Uno,10,extra\n"
+    "B,Dos\n"
+)
+RAGGED_EXPECTED = [
+    ("A", "Uno", 10.0, ""),
+    ("B", "Dos", None, ""),
+]
+
+
+def _load(content, as_bytes, tmp_path):
+    raw = content.encode("utf-8")
+    if as_bytes:
+        return cata_pdf.load_products_from_csv(raw)
+    path = tmp_path / "products.csv"
+    path.write_bytes(raw)
+    return cata_pdf.load_products_from_csv(str(path))
+
+
+@pytest.mark.parametrize("as_bytes", [False, True], ids=["path", "bytes"])
+@pytest.mark.parametrize("use_arrow", BACKENDS)
+@pytest.mark.parametrize("content, expected", [
+    (REGULAR_CSV, REGULAR_EXPECTED),
+    (RAGGED_CSV, RAGGED_EXPECTED),
+], ids=["regular", "ragged"])
+def test_load_products_backends_agree(content, expected, use_arrow, as_bytes, tmp_path, monkeypatch):
+    monkeypatch.setattr(cata_pdf, "HAS_ARROW", use_arrow)
+    assert _load(content, as_bytes, tmp_path) == expected
+
+
+def test_parse_prices_matches_parse_price():
+    raws = ["15000", "12.5", "1.500", "$ 2,5", "1.2.3", "", "abc", "$1.234,56", " 300", "٣", "²"]
+    assert cata_pdf._parse_prices(raws) == [cata_pdf._parse_price(raw) for raw in raws]
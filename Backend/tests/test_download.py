@@ -0,0 +1,124 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import db as db_module
+import main
+
+
+def test_clean_download_requires_payment(client, generate):
+    job_id = generate().json()["job_id"]
+
+    r = client.get(f"/download/{job_id}?watermark=0")
+    assert r.status_code == 402
+    assert not (main.Config.OUTPUT_DIR / f"CATA_{job_id}.pdf").exists()
+
+
+def test_clean_pdf_is_rendered_on_first_paid_download(client, generate):
+    job_id = generate().json()["job_id"]
+    assert not (main.Config.OUTPUT_DIR / f"CATA_{job_id}.pdf").exists()
+    db_module.mark_paid(job_id)
+
+    r = client.get(f"/download/{job_id}?watermark=0")
+    assert r.status_code == 200
+    assert r.content.startswith(b"%PDF")
+    assert (main.Config.OUTPUT_DIR / f"CATA_{job_id}.pdf").exists()
+
+
+def test_paid_download_without_job_inputs_is_404(client):
+    db_module.mark_paid("never-generated")
+
+    r = client.get("/download/never-generated?watermark=0")
+    assert r.status_code == 404
+
+
+def test_concurrent_paid_downloads_share_one_render(client, generate, caplog):
+    job_id = generate().json()["job_id"]
+    db_module.mark_paid(job_id)
+
+    with caplog.at_level(logging.INFO, logger="cata"):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            responses = list(pool.map(
+                lambda _: client.get(f"/download/{job_id}?watermark=0"), range(4)
+            ))
+
+    assert [r.status_code for r in responses] == [200] * 4
+    assert len({r.content for r in responses}) == 1
+    renders = [rec for rec in caplog.records if "Generating clean PDF" in rec.getMessage()]
+    assert len(renders) == 1
+
+
+def test_paid_download_after_size_cap_eviction_rerenders(client, generate):
+    job_id = generate().json()["job_id"]
+    db_module.mark_paid(job_id)
+    first = client.get(f"/download/{job_id}?watermark=0")
+    assert first.status_code == 200
+    assert (main.Config.JOBS_DIR / f"{job_id}.pkl").exists()
+
+    # The size cap evicts every PDF
+    db_module.enforce_size_limit(0, main.Config.OUTPUT_DIR)
+    assert not (main.Config.OUTPUT_DIR / f"CATA_{job_id}.pdf").exists()
+
+    again = client.get(f"/download/{job_id}?watermark=0")
+    assert again.status_code == 200
+    assert again.content.startswith(b"%PDF")
+
+
+def test_sweep_only_touches_app_named_files(tmp_path):
+    keep = tmp_path / "CATA_151c2598-dba1-40d8-af47-26983ddad026.pdf"
+    app_files = [
+        tmp_path / f"CATA_{'a' * 32}_watermark.pdf",
+        tmp_path / f"{'b' * 32}.pkl",
+        tmp_path / f"{'c' * 32}.csv",
+        tmp_path / f"{'d' * 32}.abc123.tmp",
+    ]
+    for path in [keep, *app_files]:
+        path.write_bytes(b"x")
+
+    assert db_module.cleanup_old_files(-1, [str(tmp_path)], main.APP_FILE_PATTERN) == len(app_files)
+    assert keep.exists()
+    assert db_module.enforce_size_limit(0, str(tmp_path), main.APP_FILE_PATTERN) == 0
+    assert keep.exists()
+
+
+@pytest.mark.parametrize("if_none_match", [
+    "{etag}",
+    "{strong}",
+    '"other", {etag}',
+    "*",
+])
+def test_matching_if_none_match_is_304(client, generate, if_none_match):
+    job_id = generate().json()["job_id"]
+    first = client.get(f"/preview/{job_id}")
+    etag = first.headers["etag"]
+    assert etag.startswith('W/"')
+
+    r = client.get(f"/preview/{job_id}", headers={
+        "If-None-Match": if_none_match.format(etag=etag, strong=etag.removeprefix("W/"))
+    })
+    assert r.status_code == 304
+    assert r.content == b""
+    assert r.headers["etag"] == etag
+
+
+def test_stale_if_none_match_serves_the_pdf(client, generate):
+    job_id = generate().json()["job_id"]
+
+    r = client.get(f"/preview/{job_id}", headers={"If-None-Match": 'W/"stale"'})
+    assert r.status_code == 200
+    assert r.content.startswith(b"%PDF")
+
+
+def test_cache_control_is_public_for_preview_and_private_for_paid_pdf(client, generate):
+    job_id = generate().json()["job_id"]
+    db_module.mark_paid(job_id)
+
+    preview = client.get(f"/download/{job_id}?watermark=1")
+    paid = client.get(f"/download/{job_id}?watermark=0")
+
+    assert preview.headers["cache-control"].startswith("public, ")
+    assert paid.headers["cache-control"].startswith("private, ")
+    for r in (preview, paid):
+        assert f"max-age={main.Config.PDF_CACHE_MAX_AGE}" in r.headers["cache-control"]
+        assert r.headers["cache-control"].endswith(", immutable")
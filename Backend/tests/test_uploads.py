@@ -0,0 +1,72 @@
+import os
+
+import main
+
+
+def test_generate_renders_watermarked_pdf(client, generate):
+    r = generate()
+    assert r.status_code == 200, r.text
+    job_id = r.json()["job_id"]
+
+    pdf = client.get(f"/download/{job_id}?watermark=1")
+    assert pdf.status_code == 200
+    assert pdf.content.startswith(b"%PDF")
+
+
+def test_large_csv_goes_through_disk_with_same_job_id(client, generate, monkeypatch):
+    in_memory = generate()
+    assert in_memory.status_code == 200, in_memory.text
+
+    # Force the on-disk path: same content must give the same content-hash job id
+    monkeypatch.setattr(main.Config, "CSV_MEMORY_LIMIT", 0)
+    on_disk = generate()
+    assert on_disk.status_code == 200, on_disk.text
+    assert on_disk.json()["job_id"] == in_memory.json()["job_id"]
+
+    # The temp CSV is removed once the response is sent
+    assert list(main.Config.TMP_DIR.iterdir()) == []
+
+
+def test_oversized_csv_on_disk_path_is_rejected(client, generate, monkeypatch):
+    monkeypatch.setattr(main.Config, "CSV_MEMORY_LIMIT", 0)
+    monkeypatch.setattr(main.Config, "MAX_CSV_SIZE", 16)
+
+    r = generate()
+    assert r.status_code == 413
+    assert list(main.Config.TMP_DIR.iterdir()) == []
+
+
+def test_invalid_csv_type_is_rejected(client, generate, monkeypatch):
+    monkeypatch.setattr(main.Config, "CSV_MEMORY_LIMIT", 0)
+
+    r = generate(csv_type="application/pdf")
+    assert r.status_code == 400
+    assert list(main.Config.TMP_DIR.iterdir()) == []
+
+
+def test_oversized_body_is_rejected_early_with_cors_headers(client):
+    limit = main.Config.MAX_CSV_SIZE + main.Config.MAX_LOGO_SIZE + main.Config.MULTIPART_OVERHEAD
+    r = client.post(
+        "/generate",
+        content=b"x" * (limit + 1),
+        headers={"Content-Type": "multipart/form-data; boundary=x", "Origin": "http://localhost:5500"},
+    )
+    assert r.status_code == 413
+    assert "access-control-allow-origin" in r.headers
+
+
+def test_reused_job_refreshes_file_expiry(client, generate):
+    job_id = generate().json()["job_id"]
+    pdf = main.Config.OUTPUT_DIR / f"CATA_{job_id}_watermark.pdf"
+    inputs = main.Config.JOBS_DIR / f"{job_id}.pkl"
+    for path in (pdf, inputs):
+        os.utime(path, (0, 0))
+    main.known_files.pop_expired()
+
+    r = generate()
+    assert r.status_code == 200, r.text
+    assert r.json()["job_id"] == job_id
+    for path in (pdf, inputs):
+        assert path.stat().st_mtime > 0
+    # Nothing is due to expire straight away
+    assert main.known_files.pop_expired() == []
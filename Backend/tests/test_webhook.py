@@ -7,7 +7,10 @@ from fastapi.testclient import TestClient
 import tempfile
 import os
 
+import pytest
+
 import db as db_module
+import main as main_module
 from main import app
 
 client = TestClient(app)
@@ -42,9 +45,9 @@ def test_paddle_webhook_marks_paid(tmp_path):
     private_pem = key.export_key()
     public_pem = key.publickey().export_key()
 
-    # Monkeypatch PADDLE_PUBLIC_KEY in main module
+    # Monkeypatch PADDLE_PUBLIC_KEY in the app config
     import main as main_module
-    main_module.PADDLE_PUBLIC_KEY = public_pem.decode("utf-8")
+    main_module.Config.PADDLE_PUBLIC_KEY = public_pem.decode("utf-8")
 
     job_id = "test-job-123"
 
@@ -66,5 +69,40 @@ def test_paddle_webhook_marks_paid(tmp_path):
     assert db_module.is_paid(job_id) is True
 
 
+@pytest.fixture
+def paddle_key(monkeypatch):
+    key = RSA.generate(1024)
+    monkeypatch.setattr(main_module.Config, "PADDLE_PUBLIC_KEY", key.publickey().export_key().decode("utf-8"))
+    return key.export_key()
+
+
+def test_webhook_without_content_length_is_411(client, paddle_key):
+    # A generator body is sent chunked, without Content-Length
+    r = client.post(
+        "/webhook/paddle",
+        content=iter([b"alert_name=payment_succeeded"]),
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    assert r.status_code == 411
+
+
+def test_oversized_webhook_is_413(client, paddle_key, monkeypatch):
+    monkeypatch.setattr(main_module.Config, "MAX_WEBHOOK_SIZE", 64)
+
+    r = client.post("/webhook/paddle", data={"alert_name": "payment_succeeded", "padding": "x" * 100})
+    assert r.status_code == 413
+
+
+@pytest.mark.parametrize("signature", [None, "", "not base64!", base64.b64encode(b"x" * 128).decode("ascii")])
+def test_missing_or_malformed_signature_is_401(client, paddle_key, signature):
+    payload = {"alert_name": "payment_succeeded", "passthrough": "job-401"}
+    if signature is not None:
+        payload["p_signature"] = signature
+
+    r = client.post("/webhook/paddle", data=payload)
+    assert r.status_code == 401
+    assert db_module.is_paid("job-401") is False
+
+
 if __name__ == "__main__":
     test_paddle_webhook_marks_paid(tempfile.gettempdir())